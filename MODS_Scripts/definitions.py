@@ -97,3 +97,10 @@ namespaces = {
 
 mods_ns = '{http://www.loc.gov/mods/v3}'
 copyrightMD_ns = '{http://www.cdlib.org/inside/diglib/copyrightMD}'
+
+
+""" Clark-notation tags """
+
+namePart_tag = f'{mods_ns}namePart'
+roleTerm_path = f'{mods_ns}role/{mods_ns}roleTerm'
+copyright_tag = f'{copyrightMD_ns}copyright'
@@ -1,12 +1,18 @@
 # External packages
 import sys
+import csv
+import json
+import tempfile
 from tkinter import filedialog, messagebox
 from tkinter import *
 from datetime import datetime
+import time
 import traceback
 import os
-import glob
+import re
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import pandas as pd
 
 # Local packages
@@ -15,6 +21,12 @@ from process_xml import *
 from utilities import get_pid
 from definitions import fieldnames
 
+# Prioritized fields, for membership checks
+priority_fields = frozenset(fieldnames)
+
+# Values treated as empty in output CSV
+empty_values = frozenset([None, '', '; ', '; ; '])
+
 
 """ CLASSES """
 
@@ -39,14 +51,19 @@ class Processor:
         total_files (int): The total number of files to be processed.
         progress (int): The current progress of processing (number of files processed).
         progress_var (DoubleVar): A Tkinter variable for updating the progress bar.
+        last_render (float): The monotonic time of the last progress display update.
         progress_label (int): A label indicating the progress of processing.
         processing_label (Label): A label indicating the processing status.
         complete_label (Label): A label indicating when processing is complete.
         exceptions_label (Label): A label indicating exceptions occurred during processing.
         close_button (Button): A button for closing the GUI window.
+        pool (ProcessPoolExecutor): The worker processes that process files.
+        futures (list): A list of pending results, in the same order as files (None once collected).
+        results (generator): A generator that collects results from futures in chunks.
         source (str): The input source directory or file (ZIP).
         destination (str): The output destination file (CSV).
-        records (list): A list of dictionaries representing processed records.
+        spool (file): A temporary file of processed records, one JSON object per line.
+        filled_fields (set): The field names with values across all processed records.
         exceptions (list): A list of dictionaries representing exceptions encountered during processing.
 
     Methods:
@@ -57,7 +74,9 @@ class Processor:
         get_source_by_type(source_type): Handles input source selection based on the specified type.
         get_destination(): Prompts the user to select the output destination.
         start_processing(): Initiates the processing of files.
-        manage_processor(): Manages the processing of individual files.
+        collect_results(chunk_size): Collects results of processed files, yielding after each chunk.
+        manage_processor(): Schedules result collection and updates progress.
+        cancel(): Stops processing and closes the GUI window.
         log_exceptions(): Logs any exceptions that occurred during processing.
     """
 
@@ -67,14 +86,19 @@ class Processor:
     total_files = 0
     progress = 0
     progress_var = None
+    last_render = 0.0
     progress_label = 0
     processing_label = None
     complete_label = None
     exceptions_label = None
     close_button = None
+    pool = None
+    futures = []
+    results = None
     source = None
     destination = None
-    records = []
+    spool = None
+    filled_fields = set()
     exceptions = []
 
     def __init__(self, root):
@@ -121,10 +145,14 @@ class Processor:
         # Set source       
         if source_type == 'Zip file':
             file = filedialog.askopenfilename(title='Select Input File')
-            if file:
-                self.gui.reset_text_frame()
-                self.gui.add_label("Unzipping files...")
-                self.source = extract_files(file)
+            # Confirm that file is zip file
+            if file and not zipfile.is_zipfile(file):
+                # Display file format error
+                show_error(title="Invalid File Format", 
+                           message="Input file must be a ZIP file (*.zip). " + 
+                           "Run the program and try again.")
+            # Files are read directly from the ZIP file
+            self.source = file
         else:
             self.source = filedialog.askdirectory(title='Select Input Folder')
 
@@ -201,42 +229,90 @@ class Processor:
         # Create close button for GUI window
         self.gui.add_button_frame()
         self.gui.add_button("Cancel", side=RIGHT, pady=10, 
-                            command=self.gui.close)
+                            command=self.cancel)
+        # Also stop processing if the window is closed
+        self.gui.root.protocol("WM_DELETE_WINDOW", self.cancel)
 
         # Update root to display components
         self.gui.root.update_idletasks() 
 
+        # Start this run with its own fields and exceptions, not the shared 
+        # class attributes
+        self.filled_fields = set()
+        self.exceptions = []
+
+        # Write processed records to a temporary file until output
+        self.spool = tempfile.TemporaryFile('w+', encoding='utf-8')
+
+        # Process files in worker processes
+        archive = self.source if os.path.isfile(self.source) else None
+        self.pool = ProcessPoolExecutor()
+        self.futures = [self.pool.submit(process_file, file, archive) 
+                        for file in self.files]
+        self.results = self.collect_results()
+
         self.manage_processor()
 
-    def manage_processor(self):
-        if self.progress < self.total_files:
+    def collect_results(self, chunk_size=64):
+        # Collect results of completed files, in the order submitted. Yields
+        # True after each chunk of results, or False while waiting on workers
+        while self.progress < self.total_files:
+            if not self.futures[self.progress].done():
+                yield False
+                continue
             file = self.files[self.progress]
             try:
-                # Process the MODS file
-                record = process_xml(file)
-                self.records.append(record)
+                record, tb = self.futures[self.progress].result()
             except:
-                # Log the exception for the skipped file
+                # Worker process failed before returning a result
+                record = {'identifier': get_pid(file)}
                 tb = reformat_traceback(traceback.format_exc())
+            # Release the result, so only the spool holds the record
+            self.futures[self.progress] = None
+            if tb:
+                # Log the exception for the skipped file
                 self.exceptions.append({'File': file, 'Traceback': tb})
-                self.records.append({'identifier': get_pid(file)})
                 self.progress_label -= 1
+            self.spool.write(json.dumps(record) + '\n')
+            self.filled_fields.update(get_filled_fields(record))
 
             # Update progress
             self.progress += 1
             self.progress_label += 1
-            self.progress_var.set(int((self.progress / self.total_files) * 100))
+            if self.progress % chunk_size == 0:
+                yield True
 
-            # Update processed label
+    def manage_processor(self):
+        # Collect the next chunk of results
+        ready = next(self.results, False)
+
+        # Redraw progress bar and processed label at most every 100 ms
+        now = time.monotonic()
+        if self.progress == self.total_files \
+            or now - self.last_render >= 0.1:
+            self.last_render = now
+            if self.total_files:
+                self.progress_var.set(
+                    int((self.progress / self.total_files) * 100))
             text = f"{self.progress_label}/{self.total_files} files"
             self.processing_label.config(text=text)
             self.processing_label.update_idletasks() 
 
-            # Schedule the next file processing
-            self.gui.root.after(1, self.manage_processor)
+        if self.progress < self.total_files:
+            # Collect the next chunk as soon as the GUI is idle if results are
+            # ready, otherwise check again after waiting on workers
+            if ready:
+                self.gui.root.after_idle(self.manage_processor)
+            else:
+                self.gui.root.after(50, self.manage_processor)
         else:
+            if self.pool:
+                self.pool.shutdown()
             # Notify user that processing is complete
-            records_to_csv(records=self.records, destination=self.destination)
+            records_to_csv(records=read_spool(self.spool), 
+                           destination=self.destination, 
+                           fields=self.filled_fields)
+            self.spool.close()
             self.complete_label.config(text="Complete!")
             if self.exceptions:
                 self.log_exceptions()
@@ -248,119 +324,154 @@ class Processor:
             self.gui.add_button("OK", side=RIGHT, pady=10, 
                                 command=self.gui.close)
     
+    def cancel(self):
+        # Stop worker processes, dropping files not yet processed
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        if self.spool:
+            self.spool.close()
+        self.gui.close()
+
     def log_exceptions(self):
-        # Create or append to a text file with exception information
+        # Create or append to a text file with exception information, 
+        # alongside the output CSV
         current_datetime = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filepath = f'exceptions_{current_datetime}.csv'
+        filepath = os.path.join(os.path.dirname(self.destination), 
+                                f'exceptions_{current_datetime}.csv')
         exceptions_df = pd.DataFrame.from_dict(self.exceptions)
         exceptions_df.to_csv(filepath, index=False, encoding='utf-8')
 
 
 """ Helper Functions """
 
+# Open ZIP file for reading, keeping it open for reuse in the same process
+@lru_cache(maxsize=None)
+def open_zip_archive(filepath: str):
+    return zipfile.ZipFile(filepath, 'r')
+
+
+# Process given MODS file (or ZIP file member, if archive is given) in a 
+# worker process, returning the record and the formatted traceback (if an 
+# exception occurred)
+def process_file(file: str, archive: str = None):
+    try:
+        if archive:
+            with open_zip_archive(archive).open(file) as fileobj:
+                return process_xml(file, fileobj), None
+        return process_xml(file), None
+    except:
+        tb = reformat_traceback(traceback.format_exc())
+        return {'identifier': get_pid(file)}, tb
+
+
 # Show a given error and exit program
 def show_error(title: str, message: str):
     messagebox.showerror(title=title, message=message)
     sys.exit(0)
     
 
-# Extract files from compressed file (Zip) into a directory
-def extract_files(filepath: str):
-    output_dir = ""
-    
-    # Confirm that file is zip file
-    if zipfile.is_zipfile(filepath):
-        directory = os.path.dirname(filepath)
-        filename = os.path.basename(filepath)
-        output_dir = '%s\\%s' % (directory, os.path.splitext(filename)[0])
-
-        # Extract files to output_dir
-        with zipfile.ZipFile(filepath, 'r') as zip_archive:
-            zip_archive.extractall(output_dir)
-    else:
-        # Display file format error
-        show_error(title="Invalid File Format", 
-                   message="Input file must be a ZIP file (*.zip). " + 
-                   "Run the program and try again.")
-    
-    return output_dir
-
-
 # Get list of files to be processed
 def get_files(source):
-    # Change working directory to source directory
-    os.chdir(source)
-    # Get list of XML files in directory
-    files = glob.glob('*.xml')
+    if os.path.isfile(source):
+        # Get list of XML files (any case extension) in Zip file, skipping 
+        # macOS metadata and hidden files
+        with zipfile.ZipFile(source, 'r') as zip_archive:
+            files = [name for name in zip_archive.namelist() 
+                     if name.lower().endswith('.xml') 
+                     and not name.startswith('__MACOSX/')
+                     and not os.path.basename(name).startswith('.')]
+    else:
+        # Get list of XML files (any case extension) in source directory, 
+        # skipping hidden files
+        with os.scandir(source) as entries:
+            files = [os.path.join(source, entry.name) for entry in entries 
+                     if entry.name.lower().endswith('.xml') 
+                     and not entry.name.startswith('.') and entry.is_file()]
     # Remove finding aids from list of files
     files = remove_finding_aids(files)
     return files
 
 
+# Finding aid filename patterns, matched in a single case-insensitive pass
+fa_patterns = ['666980084','clp.','mss.','qss','rg04.201','ppi','us-qqs']
+fa_regex = re.compile('|'.join(re.escape(pattern) for pattern in fa_patterns),
+                      re.IGNORECASE)
+
+
 # Remove finding aids from input files based on filename patterns
 def remove_finding_aids(files: list):
-    fa_patterns = ['666980084','clp.','mss.','qss','rg04.201','ppi','us-qqs']
-    files_to_remove = []
+    return [filename for filename in files 
+            if not fa_regex.search(os.path.basename(filename))]
 
-    # Generate list of finding aids identified by a finding aid filename pattern
-    for filename in files:
-        if any(pattern in filename.lower() for pattern in fa_patterns):
-            files_to_remove.append(filename)
 
-    # Remove finding aids from list of files
-    for file in files_to_remove:
-        files.remove(file)
-
-    return files
+# Rename column header: Split string on forward slashes, reverse the order, 
+# and rejoin. Replace at symbols with forward slash and spaces with underscore
+# Ex: physicalDescription/form@marcform >> form/marcform/physicalDescription
+@lru_cache(maxsize=None)
+def rename_header(header: str):
+    return '/'.join(header.split('/')[::-1]).replace('@', '/').replace(' ', '_')
 
 
-# Modify column headers and add URL column for final output
-def update_columns(df: pd.DataFrame):
-    # Sort DataFrame by column name (alphabetical, ascending order)
-    df = df[sorted(df.columns)]
+# Get fields with non-empty values in given record
+def get_filled_fields(record: dict):
+    return [field for field, value in record.items() 
+            if value not in empty_values]
 
-    # Rename columns: Split each string on forward slashes, reverse the order, 
-    # and rejoin. Replace at symbols with forward slash and spaces with underscore
-    # Ex: physicalDescription/form@marcform >> form/marcform/physicalDescription
-    df.columns = [
-        '/'.join(header.split('/')[::-1]).replace('@', '/').replace(' ', '_') 
-        for header in df.columns.tolist()
-    ]
-    
-    # Add columns not in target fields
-    for fieldname in df.columns.values:
-        if fieldname not in fieldnames:
-            fieldnames.append(fieldname)
 
+# Get column headers for final output from given fields with values: target 
+# fields first, then all other fields sorted by original field name
+def get_columns(fields: set):
+    headers = [rename_header(field) for field in sorted(fields)]
     # Add column with URL for object
+    if 'identifier' in headers:
+        headers.append('url')
+    target_fields = [field for field in fieldnames if field in headers]
+    other_fields = [header for header in dict.fromkeys(headers) 
+                    if header not in priority_fields]
+    return target_fields + other_fields
+
+
+# Get row for final output from given record, with renamed fields and URL
+def get_row(record: dict):
     url_prefix = "https://gamera.library.pitt.edu/islandora/object/pitt:"
-    if 'identifier' in df.columns:
-        df['url'] = url_prefix + df['identifier']
+    row = {rename_header(field): value for field, value in record.items() 
+           if value not in empty_values}
+    if 'identifier' in row:
+        row['url'] = url_prefix + row['identifier']
+    return row
+
+
+# Read processed records back from the start of given spool file
+def read_spool(spool):
+    spool.seek(0)
+    for line in spool:
+        yield json.loads(line)
 
-    # Reorder columns
-    df = df.reindex(columns=fieldnames)
-    return df
 
+# Process records and export to a CSV file, one row at a time. Fields with 
+# values in records are collected from the records if not given
+def records_to_csv(records, destination: str, fields: set = None):
+    if fields is None:
+        records = list(records)
+        fields = {field for record in records 
+                  for field in get_filled_fields(record)}
 
-# Process records and export to a CSV file
-def records_to_csv(records: list, destination: str):
-    # Convert list of dictionaries to DataFrame
-    df = pd.DataFrame.from_dict(records)
-    df = update_columns(df)
+    # Write rows to CSV file, with the same line endings as pandas
+    with open(destination, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=get_columns(fields), 
+                                extrasaction='ignore', lineterminator=os.linesep)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(get_row(record))
 
-    # Remove empty values
-    nan_value = float("NaN")
-    df.replace({'': nan_value, '; ': nan_value, '; ; ': nan_value}, inplace=True)
-    df.dropna(how='all', axis=1, inplace=True)
 
-    # Write DataFrame to CSV file
-    df.to_csv(destination, index=False, header=True, encoding='utf-8')
+# Traceback prefix for lines in this script
+script_prefix = f'File "{os.path.abspath(__file__)}", '
 
 
 # Remove script filename from given traceback
 def reformat_traceback(tb: str):
-    script_path = os.path.abspath(__file__)
-    return tb.replace(f'File "{script_path}", ', '').strip()
+    return tb.replace(script_prefix, '').strip()
 
 
 """ Driver Code """
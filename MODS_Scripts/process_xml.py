@@ -1,66 +1,40 @@
 # Extrenal packages
 from lxml import etree as ET
 import re
+import sys
+from collections import defaultdict
 
 # Local packages
 from utilities import *
-from definitions import columns, namespaces, mods_ns
+from definitions import columns, namespaces, mods_ns, copyrightMD_ns, \
+    namePart_tag, roleTerm_path, copyright_tag
 
 
-""" Classes """
+""" XML Parser """
 
-class ModsElement:
-    """
-    Represents a MODS (Metadata Object Description Schema) element for extracting data from XML documents.
-
-    Attributes:
-        root (Element): The root element of the XML document.
-        xpath (str): The XPath expression for locating the MODS element within the XML document.
-        namespace (dict): A dictionary containing namespace prefixes and URIs for XPath expressions.
-        elementname (str): The name of the MODS element.
-        additional_args (dict): Additional keyword arguments for specifying parameters.
-
-    Methods:
-        get_element_value(): Retrieves the text value of the MODS element specified by the XPath expression.
-        get_complex_element(): Retrieves values from sibling elements based on specified criteria.
-        get_element_attrib(): Sets the attribute value to 'yes' if the XPath expression matches an element in the XML document.
-    """
+# Shared parser that drops whitespace-only text
+parser = ET.XMLParser(remove_blank_text=True, collect_ids=False)
+
+
+""" Compiled XPath Expressions """
+
+date_qualifier_xpath = ET.XPath(
+    ".//mods:dateCreated[@qualifier='approximate'][@encoding='iso8601']"
+    "[@keyDate='yes']", namespaces=namespaces['mods_ns'])
+namePart_xpath = ET.ETXPath(namePart_tag)
+roleTerm_xpath = ET.ETXPath(roleTerm_path)
+copyright_xpath = ET.ETXPath(copyright_tag)
 
-    def __init__(self, root, xpath, namespace, elementname, **kwargs):
-        self.root = root
-        self.xpath = xpath
-        self.namespace = namespace
-        self.elementname = elementname
-        self.additional_args = kwargs
-
-    # Get the text value of the MODS element
-    def get_element_value(self):
-        if self.root.find(self.xpath, self.namespace) is not None:
-            elementname = self.root.find(self.xpath, self.namespace).text
-            return elementname
-        else:
-            elementname = ''
-            return elementname
-
-    # Get values from data values from sibling elements
-    def get_complex_element(self):
-        value_list = []
-        #if 'text' in self.additional_args.keys():
-        for element in self.root.findall(self.xpath, self.namespace):
-            if element is not None \
-                and element.text == self.additional_args['text']:
-                value_list.append(element.getparent().getprevious().text)
-                return value_list
-
-    # Set element attribute value to 'yes' if XPath is not null
-    def get_element_attrib(self):
-        if self.root.find(self.xpath, self.namespace) is not None:
-            elementattrib = 'yes'
-            return elementattrib
-        
 
 """ Helper Functions """
 
+# Tags without MODS namespace, keyed by fully-qualified tag
+tag_cache = {}
+
+# Fields whose data is extracted from a parent element, not by XPath and text
+special_fields = frozenset(['copyright', 'namePart', 'roleTerm', 'subject'])
+
+
 # Check if the given root has the MODS namespace prefix and add if not
 def ensure_mods_prefix(tree: ET.ElementTree, root: ET.Element):
     if not root.prefix:
@@ -78,11 +52,12 @@ def ensure_mods_prefix(tree: ET.ElementTree, root: ET.Element):
 
 # Check if the given element is a special field
 def check_special_field(element: ET.Element, xpath: str):
-    special_fields = ['copyright', 'namePart', 'roleTerm', 'subject']
-    for field in special_fields:
-        if field in xpath and 'relatedItem' not in xpath:
-            return True
-    return False
+    if 'relatedItem' in xpath:
+        return False
+    # Check element's own tag before searching the XPath for a special parent
+    if get_tag(element) in special_fields:
+        return True
+    return any(field in xpath for field in special_fields)
 
 
 # Get XPath for given element and proccess string to simplify
@@ -99,18 +74,25 @@ def get_xpath(xml_object, element: ET.Element):
     return xpath
 
 
-# Get tag attribute of element
-def get_tag(element: ET.Element):
-    return element.tag.replace(mods_ns, '')
+# Get the XPath step (tag without namespace prefix or index) for given element
+def get_xpath_step(xml_object, element: ET.Element):
+    tag = element.tag
+    if tag.startswith(mods_ns):
+        return get_tag(element)
+    if tag.startswith(copyrightMD_ns):
+        return tag[len(copyrightMD_ns):]
+    # Fall back on full XPath for elements in other namespaces
+    return get_xpath(xml_object, element).rsplit('/', 1)[-1]
 
 
-# Generate a list of an element's parents
-def get_parents(root: ET.Element, element: ET.Element):
-    parent_list = []
-    while element.getparent() != root:
-        parent_list.append(element.getparent().tag.replace(mods_ns, ''))
-        element = element.getparent()
-    return parent_list
+# Get tag attribute of element, without MODS namespace. Tags are cached and 
+# interned, since a small set of tags repeats across every element and file
+def get_tag(element: ET.Element):
+    tag = element.tag
+    local_tag = tag_cache.get(tag)
+    if local_tag is None:
+        local_tag = tag_cache[tag] = sys.intern(tag.replace(mods_ns, ''))
+    return local_tag
 
 
 # Get text values from given list of child elements
@@ -125,22 +107,21 @@ def get_child_text(parent: ET.Element):
 
 # Get namePart and roleTerm values (if any) from given name element
 def get_name_value(name: ET.Element):
-    name = ET.ElementTree(name)
-    namePart = name.find(f"{mods_ns}namePart")
-    if namePart is None:
+    namePart = namePart_xpath(name)
+    if not namePart:
         return None
-    roleTerm = name.find(f'{mods_ns}role/{mods_ns}roleTerm')
-    value = f"{namePart.text} [{roleTerm.text}]" \
-        if roleTerm is not None else namePart.text
+    roleTerm = roleTerm_xpath(name)
+    value = f"{namePart[0].text} [{roleTerm[0].text}]" \
+        if roleTerm else namePart[0].text
     return value
 
 
 # Get publication status and copyright status from given accessCondition element
 def get_copyright_data(accessCondition: ET.Element):
-    copyright = accessCondition.find(
-        'copyrightMD:copyright', namespaces['copyright_ns'])
-    if copyright is None:
+    copyright = copyright_xpath(accessCondition)
+    if not copyright:
         return []
+    copyright = copyright[0]
     data = [('publication_status', copyright.attrib.get('publication.status')),
             ('copyright_status', copyright.attrib.get('copyright.status'))]
     return [(key, value) for key, value in data if value]
@@ -155,7 +136,7 @@ def get_subject_data(subject: ET.Element):
     if not children:
         return data
     main_child = children[0]
-    child_tag = main_child.tag.replace(mods_ns, '')
+    child_tag = get_tag(main_child)
 
     # Name field
     field = f"subject/{child_tag}"
@@ -168,7 +149,7 @@ def get_subject_data(subject: ET.Element):
 
     # Extract and transform data
     for child in children:
-        cur_tag = child.tag.replace(mods_ns, '')
+        cur_tag = get_tag(child)
         if cur_tag == 'name':
             values.append(get_name_value(child))
         elif cur_tag == 'titleInfo':
@@ -178,15 +159,14 @@ def get_subject_data(subject: ET.Element):
         elif cur_tag == 'cartographics': 
             # Assumes there are no other children in subject
             for grandchild in child.getchildren():
-                grandchild_tag = grandchild.tag.replace(mods_ns, '')
+                grandchild_tag = get_tag(grandchild)
                 data.append((grandchild_tag, grandchild.text))
         else:
             values.append(child.text)
 
-    # Remove NoneType values
-    values = [value for value in values if value is not None and value != '']
-    if values:
-        values_str = '--'.join(values)
+    # Join values, skipping NoneType and empty values
+    values_str = '--'.join(value for value in values if value)
+    if values_str:
         data.append((field, values_str))
     
     return data
@@ -197,15 +177,12 @@ def get_name_data(name: ET.Element):
     data = []
     roles = ['creator', 'contributor', 'depositor', 
              'interviewer', 'interviewee', 'other_names']
-    name = ET.ElementTree(name)
-    try:
-        namePart = name.find(f'{mods_ns}namePart').text
-    except:
+    namePart = namePart_xpath(name)
+    if not namePart:
         return data
-    try:
-        roleTerm = name.find(f'{mods_ns}role/{mods_ns}roleTerm').text
-    except:
-        roleTerm = None
+    namePart = namePart[0].text
+    roleTerm = roleTerm_xpath(name)
+    roleTerm = roleTerm[0].text if roleTerm else None
     if roleTerm in roles or roleTerm is None:
         data.append((roleTerm or 'other_names', namePart))
     else:
@@ -213,44 +190,51 @@ def get_name_data(name: ET.Element):
     return data
 
 
-# Add type attribute value for name element to XPath
-def add_name_type(element: ET.Element, xpath: str):
-    name = element.getparent()
-    type_attribute = name.get('type')
+# Add type attribute value of name element (the parent) to XPath
+def add_name_type(xpath: str, type_attribute: str):
     if type_attribute is not None:
         xpath = xpath.replace('name/', f'name@{type_attribute}/')
     return xpath
 
 
-# Add type attribute value for relatedItem element to XPath
-def add_relatedItem_type(element: ET.Element, xpath: str):
-    parent = element.getparent()
-    while get_tag(parent) != 'relatedItem':
-        parent = parent.getparent()
-    type_attribute = parent.get('type')
+# Add type attribute value of nearest relatedItem ancestor to XPath
+def add_relatedItem_type(xpath: str, type_attribute: str):
     if type_attribute is not None:
         xpath = xpath.replace('relatedItem/', f'relatedItem@{type_attribute}/')
     return xpath
 
 
+# Column name for display dates
+display_date_field = columns['originInfo/dateOther@display']
+
+
 # Add date qualifier value if circa (or abbreviations) in display date
 def check_date_qualifier(record=dict):
     if not record.get('normalized_date_qualifier') \
         and record.get('dateOther/display/originInfo'):
-        if any(pattern in record.get(columns['originInfo/dateOther@display']) \
+        if any(pattern in record.get(display_date_field) \
                for pattern in ['c.', 'ca.', 'circa']):
             record.setdefault('normalized_date_qualifier', 'yes')
     return record
 
 
+# Functions to get data from container elements, keyed by XPath
+data_getters = {
+    'accessCondition': get_copyright_data,
+    'subject': get_subject_data,
+    'name': get_name_data,
+    }
+
+
 """ Main Function """
 
-def process_xml(file):
+def process_xml(file, fileobj=None):
     """
     Processes an XML file containing MODS (Metadata Object Description Schema) data and extracts relevant information.
 
     Args:
-        file (str): The path to the XML file to be processed.
+        file (str): The path to the XML file to be processed, or its name if fileobj is given.
+        fileobj (file-like, optional): An open file (e.g., a Zip file member) to read the XML from instead of the path.
 
     Returns:
         dict: A dictionary containing the extracted MODS data, with field names as keys and corresponding values.
@@ -261,22 +245,44 @@ def process_xml(file):
     """
 
     # Create an XML object that python can parse
-    xml_object = ET.parse(file)
+    xml_object = ET.parse(fileobj if fileobj is not None else file, parser)
     # Get the root of that object
     root = xml_object.getroot()
     # Ensure that XML tree elements have MODS namespace prefix
     xml_object, root = ensure_mods_prefix(xml_object, root)
 
-    # Create dictionary with element xpath as key and text as value
-    record = {}
-
-    for element in root.xpath('.//*'):
-        xpath = get_xpath(xml_object, element)
+    # Create dictionary with element xpath as key and list of text as value
+    record = defaultdict(list)
+    # XPath steps from the root to the current element
+    path = []
+    # Type attributes of the elements on the path, and of the nearest 
+    # relatedItem element at or above each (starting with none)
+    types = []
+    relatedItem_types = [None]
+
+    # Walk the tree once, building each element's XPath from its ancestors'
+    for event, element in ET.iterwalk(root, events=('start', 'end')):
+        # Skip comments, processing instructions, and entities
+        if not isinstance(element.tag, str):
+            continue
+        if event == 'end':
+            path.pop()
+            types.pop()
+            relatedItem_types.pop()
+            continue
+        tag = get_tag(element)
+        type_attribute = element.attrib.get('type')
+        path.append(get_xpath_step(xml_object, element))
+        types.append(type_attribute)
+        relatedItem_types.append(type_attribute if tag == 'relatedItem' 
+                                 else relatedItem_types[-1])
+        # Skip the root element
+        if len(path) == 1:
+            continue
+        xpath = '/'.join(path[1:])
         special_field = check_special_field(element, xpath)
-        tag = element.tag.replace(f'{mods_ns}', '')
         text = remove_whitespaces(element.text)
         data = []
-        type_attribute = element.attrib.get('type')
         authority_attribute = element.attrib.get('authority')
         
         # Check that current element and parent are not special/nested fields
@@ -292,35 +298,30 @@ def process_xml(file):
                 field += f'@{authority_attribute}'
             # Add type to name element
             if tag in ['namePart', 'roleTerm']:
-                field = add_name_type(element, xpath)
+                field = add_name_type(xpath, types[-2])
             if 'relatedItem/' in field:
-                field = add_relatedItem_type(element, field)
+                field = add_relatedItem_type(field, relatedItem_types[-2])
             # Update xpath to corresponding column name, if one exists
-            field = columns[field] if field in columns else field
+            field = columns.get(field, field)
             # Add data to record
             data.append((field, value))
-        elif xpath == 'accessCondition':
-            data = get_copyright_data(element)
-        elif xpath == 'subject':
-            data = get_subject_data(element)
-        elif xpath == 'name':
-            data = get_name_data(element)
+        else:
+            get_data = data_getters.get(xpath)
+            if get_data:
+                data = get_data(element)
 
         # Add element data to record dictionary
         for field, value in data:
             if value:
                 value = remove_whitespaces(value)
-                record.setdefault(field, []).append(value)
-
-    # Create a MODS element from Xpath
-    date_qualifier = ModsElement(
-        root=root,
-        xpath=".//mods:dateCreated[@qualifier='approximate'][@encoding='iso8601'][@keyDate='yes']", 
-        namespace=namespaces['mods_ns'], 
-        elementname='date_qualifier'
-        )
+                record[field].append(value)
+
+    # Convert to a plain dictionary, so missing fields are not added on lookup
+    record = dict(record)
+
+    # Set date qualifier to 'yes' if there is an approximate key date
     record.setdefault('normalized_date_qualifier',
-                        date_qualifier.get_element_attrib())
+                      'yes' if date_qualifier_xpath(root) else None)
 
     # Check normalized_date_qualifier
     record = check_date_qualifier(record)
@@ -331,8 +332,7 @@ def process_xml(file):
         record.setdefault('identifier', pid)
 
     # Convert field values from lists to strings
-    for field, value in record.items(): 
-        if type(value) is list:
-            record[field] = '; '.join(value)
+    record = {field: '; '.join(value) if isinstance(value, list) else value 
+              for field, value in record.items()}
 
     return record
\ No newline at end of file
@@ -1,9 +1,10 @@
 # External packages
-import re
+import os
 
 
 # Extract object PID from MODS filename
 def get_pid(file=str):
+    file = os.path.basename(file)
     pid = file.replace("pitt_", "").replace("_MODS", "").replace(".xml", "")
     return pid
 
@@ -11,9 +12,10 @@ def get_pid(file=str):
 # Remove newline characters, trailing whitespaces, and multiple spaces from text
 def remove_whitespaces(text):
     if isinstance(text, str):
-        new_text = text.replace('\n    ', ' ').replace('\n', '').strip()
-        new_text = re.sub(r'\s+', ' ', new_text)
-        return new_text.strip()
+        if '\n' in text:
+            text = text.replace('\n    ', ' ').replace('\n', '')
+        # Splitting on whitespace both strips and collapses runs of spaces
+        return ' '.join(text.split())
     return ''
 
 